@@ -1,14 +1,21 @@
-import copy
 import json
+import logging
+import time
 import traceback
+from collections import deque
+from functools import partial
 from typing import Optional
 
+import orjson
+from gevent.pool import Pool
+
 from lib.api_caller import ConfigurableExternalAPICaller
 from lib.aws_iam import AWSIAM
-from lib.connector import BaseConnector, response_to_object
+from lib.connector import BaseConnector, response_to_object_from_response
 from lib.error import ConfigError
 from lib.httpadapters import init_mtls_ssl_adapter, SSLAdapter
 
+from requests import Response
 from requests.exceptions import HTTPError
 
 
@@ -46,6 +53,12 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
             'example': False,
             'default': False
         },
+        'detail_workers': {
+            'order': 6,
+            'example': 1,
+            'default': 1,
+            'validator': int
+        },
     }
 
     session_auth_behavior = None
@@ -60,6 +73,10 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
     MAX_ITERATIONS = 1000
 
+    # NOTE: the SaaS authorization generated with the session-based flow is reused for this period
+    # of time (in seconds) and invalidated earlier if the SaaS API rejects it
+    SAAS_AUTHORIZATION_TTL = 55 * 60
+
     def __init__(self, section, settings):
         self.inputs_from_cloud = settings.pop('inputs', {})
         self.list_behavior = settings.pop('list_behavior', {})
@@ -69,6 +86,8 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         self.RecordType = settings.pop('type')
         self.MappingName = settings.pop('name')
         self.ConnectorID = settings.pop('id')
+        self._session_auth_secret = None
+        self._mtls_ssl_adapters = {}
         update_only = settings.pop('update_only')
         insert_only = settings.pop('insert_only')
 
@@ -76,6 +95,7 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
         self.settings['update_only'] = update_only
         self.settings['insert_only'] = insert_only
+        self._normalize_settings()
         self.saas_authorization_loader()
         self.oomnitza_authorization_loader()
 
@@ -85,6 +105,28 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         if self.saas_behavior is not None and self.saas_behavior.get('enabled'):
             self.field_mappings['SAAS'] = {'source': "saas"}
 
+        self._saas_payload = self._build_saas_payload()
+
+        # NOTE: the links are parsed from the `Link` header every time they are accessed, so do not
+        # do this for every page unless some template actually refers them
+        self._uses_list_response_links = 'list_response_links' in json.dumps(
+            [self.list_behavior, self.detail_behavior, self.software_behavior, self.session_auth_behavior, self.inputs_from_cloud],
+            default=str
+        )
+
+    def _normalize_settings(self):
+        """
+        The settings containing the JSON can be given as the string (e.g. from the .ini file), parse these only once here,
+        so the rest of the code deals with the native values only
+        """
+        for key in ('saas_authorization', 'local_inputs'):
+            value = self.settings.get(key)
+            if isinstance(value, str):
+                try:
+                    self.settings[key] = orjson.loads(value)
+                except orjson.JSONDecodeError:
+                    raise ConfigError(f'Managed connector #{self.ConnectorID}: {key} must be a valid JSON. Exiting')
+
     def saas_authorization_loader(self):
         """
         There can be two options here:
@@ -96,9 +138,6 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
         """
         value = self.settings['saas_authorization']
-        if isinstance(value, str):
-            value = json.loads(value)
-
         if not isinstance(value, dict):
             raise ConfigError(f'Managed connector #{self.ConnectorID}: Information for the authorization in SaaS must be presented in form of dictionary JSON')
 
@@ -158,7 +197,7 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         response = self.perform_api_request(logger=self.logger, **api_call_specification)
         response_headers = response.headers
 
-        response = response_to_object(response.text)
+        response = response_to_object_from_response(response)
 
         self.update_rendering_context(
             response=response,
@@ -188,34 +227,103 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         There can be two options here:
             - there is credential_id string to be used in case of cloud connector setup
             - there is a JSON containing the ready-to-use headers and params in case of on-premise connector setup
+
+        The session-based authorization is cached for SAAS_AUTHORIZATION_TTL seconds, so we do not call
+        the session auth endpoint for every single page and item
         """
         ssl_adapter = None
 
         credential_id = self.settings['saas_authorization'].get('credential_id')
         if credential_id:
+            # NOTE: the secret is requested for the exact API call and can be bound to it (e.g. the AWS request signature),
+            # so it cannot be reused for the other calls, only the mTLS adapter built from the certificates can
             secret = self.OomnitzaConnector.get_secret_by_credential_id(credential_id, **api_call_specification)
             if secret['certificates']:
-                ssl_adapter = init_mtls_ssl_adapter(secret['certificates'])
+                ssl_adapter = self._get_mtls_ssl_adapter(secret['certificates'])
 
         else:
             if self.session_auth_behavior:
-                secret = self.generate_session_based_secret()
+                if self._session_auth_secret is None or time.monotonic() >= self._session_auth_secret[1]:
+                    self._session_auth_secret = (
+                        self.generate_session_based_secret(),
+                        time.monotonic() + self.SAAS_AUTHORIZATION_TTL
+                    )
+                secret = self._session_auth_secret[0]
             else:
                 secret = self.settings['saas_authorization']
 
         return secret['headers'], secret['params'], ssl_adapter
 
-    def save_test_response_to_file(self):
-        self.logger.info("Getting test response from custom integration")
-        api_call_specification = self.build_call_specs(self.list_behavior)
+    def _get_mtls_ssl_adapter(self, certificates: dict) -> Optional[SSLAdapter]:
+        """
+        Build the mTLS adapter only once per set of certificates, so the certificates are not processed again
+        for every single call and the connections opened with the adapter are reused
+        """
+        key = json.dumps(certificates, sort_keys=True)
+        if key not in self._mtls_ssl_adapters:
+            self._mtls_ssl_adapters[key] = init_mtls_ssl_adapter(certificates)
+        return self._mtls_ssl_adapters[key]
 
+    def invalidate_saas_authorization(self):
+        """
+        Drop the cached SaaS authorization, the next call will generate the new one
+        """
+        self._session_auth_secret = None
+
+    def _is_rejected_saas_authorization(self, exc: HTTPError, session_auth_secret: Optional[tuple]) -> bool:
+        return getattr(exc.response, 'status_code', None) == 401 and session_auth_secret is not None
+
+    def _authorize_call_specs(self, api_call_specification: dict) -> (dict, Optional[tuple]):
+        """
+        Attach the SaaS authorization to the copy of the given call specs. The cached session-based authorization used
+        for the call is returned as well, so the rejection of it can be told apart from the rejection of the renewed one
+        """
+        api_call_specification = self._shallow_clone_spec(api_call_specification)
         auth_headers, auth_params, ssl_adapter = self.attach_saas_authorization(api_call_specification)
+        session_auth_secret = self._session_auth_secret
+
         api_call_specification['headers'].update(**auth_headers)
         api_call_specification['params'].update(**auth_params)
         api_call_specification['ssl_adapter'] = ssl_adapter
+        return api_call_specification, session_auth_secret
 
-        response = self.perform_api_request(logger=self.logger, **api_call_specification)
-        self.logger.debug("..response: %s", response.text)
+    def _perform_authorized_api_request(self, api_call_specification: dict) -> Response:
+        authorized_call_specification, _ = self._authorize_call_specs(api_call_specification)
+        return self.perform_api_request(logger=self.logger, **authorized_call_specification)
+
+    def _retry_if_saas_authorization_rejected(self, exc: HTTPError, api_call_specification: dict, session_auth_secret: Optional[tuple]) -> Response:
+        """
+        If the cached authorization was rejected by the SaaS API (it has expired earlier than expected or has been revoked),
+        invalidate it and retry the call once, otherwise raise the given error.
+
+        If the rejected authorization has already been renewed by the other call, the call is retried with the renewed one.
+        Many APIs allow only one active session, so logging in again would revoke the authorization just renewed
+        """
+        if not self._is_rejected_saas_authorization(exc, session_auth_secret):
+            raise exc
+
+        if session_auth_secret is self._session_auth_secret:
+            self.logger.info('The SaaS authorization has been rejected, retrying with the new one')
+            self.invalidate_saas_authorization()
+        return self._perform_authorized_api_request(api_call_specification)
+
+    def perform_authorized_api_request(self, api_call_specification: dict) -> Response:
+        """
+        Perform the API call with the SaaS authorization attached, retry it once if the cached authorization was rejected
+        """
+        authorized_call_specification, session_auth_secret = self._authorize_call_specs(api_call_specification)
+        try:
+            return self.perform_api_request(logger=self.logger, **authorized_call_specification)
+        except HTTPError as exc:
+            return self._retry_if_saas_authorization_rejected(exc, api_call_specification, session_auth_secret)
+
+    def save_test_response_to_file(self):
+        self.logger.info("Getting test response from custom integration")
+        api_call_specification = self.build_call_specs(self.list_behavior)
+
+        response = self.perform_authorized_api_request(api_call_specification)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("..response: %s", response.text)
 
         try:
             self.save_data_locally(response.json(), self.settings['__name__'])
@@ -223,6 +331,20 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
             self.logger.exception("Unable to convert response to JSON: %s", response.text)
         return response.text
 
+    @staticmethod
+    def _shallow_clone_spec(api_call_specification: dict) -> dict:
+        """
+        Copy the API call specification not touching the original one. The specification is a plain JSON-like structure
+        where only headers, params and body can be nested, so there is no need for the generic deepcopy
+        """
+        body = api_call_specification.get('body')
+        return {
+            **api_call_specification,
+            'headers': dict(api_call_specification['headers']),
+            'params': dict(api_call_specification['params']),
+            'body': dict(body) if isinstance(body, dict) else body,
+        }
+
     def get_list_of_items(self, iam_credentials: dict = None, skip_empty_response: bool = False):
         iteration = 0
         try:
@@ -237,6 +359,8 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
             pagination_dict     = self.list_behavior.get('pagination', {})
             break_early_control = pagination_dict.get('break_early')
             add_if_control      = pagination_dict.get('add_if')
+            pagination_headers  = pagination_dict.get('headers', [])
+            pagination_params   = pagination_dict.get('params', [])
             result_control      = self.list_behavior.get('result')
 
             while iteration < self.MAX_ITERATIONS:
@@ -249,29 +373,28 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
                         break
 
                     if bool(self.render_to_native(add_if_control)):
-                        extra_headers = {_['key']: self.render_to_string(_['value']) for _ in pagination_dict.get('headers', [])}
-                        extra_params = {_['key']: self.render_to_string(_['value']) for _ in pagination_dict.get('params', [])}
+                        extra_headers = {_['key']: self.render_to_string(_['value']) for _ in pagination_headers}
+                        extra_params = {_['key']: self.render_to_string(_['value']) for _ in pagination_params}
                         api_call_specification['headers'].update(**extra_headers)
                         api_call_specification['params'].update(**extra_params)
 
                 if iam_credentials:
-                    iam_call_specification = copy.deepcopy(api_call_specification)
+                    iam_call_specification = self._shallow_clone_spec(api_call_specification)
                     iam_call_specification.update(**iam_credentials)
 
                     iam_session_secret = self.OomnitzaConnector.get_aws_session_secret(**iam_call_specification)
                     auth_headers = iam_session_secret['headers']
                     auth_params = iam_session_secret['params']
                     # NOTE: There are no required mTLS Certs for AWS API. So skip it
-                    ssl_adapter = None
-                else:
-                    auth_headers, auth_params, ssl_adapter = self.attach_saas_authorization(api_call_specification)
+                    api_call_specification['headers'].update(**auth_headers)
+                    api_call_specification['params'].update(**auth_params)
+                    api_call_specification['ssl_adapter'] = None
 
-                api_call_specification['headers'].update(**auth_headers)
-                api_call_specification['params'].update(**auth_params)
-                api_call_specification['ssl_adapter'] = ssl_adapter
+                    response = self.perform_api_request(logger=self.logger, **api_call_specification)
+                else:
+                    response = self.perform_authorized_api_request(api_call_specification)
 
-                response = self.perform_api_request(logger=self.logger, **api_call_specification)
-                list_response = response_to_object(response.text)
+                list_response = response_to_object_from_response(response)
 
                 if list_response and "shim_error_message" in list_response:
                     # If we use the shim service we don't want to see http://localhost in the webui error screen.
@@ -280,7 +403,7 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
                 self.update_rendering_context(
                     list_response=list_response,
                     list_response_headers=response.headers,
-                    list_response_links=response.links
+                    list_response_links=response.links if self._uses_list_response_links else {}
                 )
                 result = self.render_to_native(result_control)
 
@@ -295,9 +418,7 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
                     yield entity
 
                 iteration += 1
-                self.update_rendering_context(
-                    iteration=iteration
-                )
+                self.rendering_context['iteration'] = iteration
 
         except self.ManagedConnectorListGetEmptyInBeginningException as exc:
             raise exc
@@ -326,58 +447,146 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
         return access_token
 
-    def get_detail_of_item(self, list_response_item):
-        if self.detail_behavior:
-            try:
-                self.update_rendering_context(
-                    list_response_item=list_response_item,
-                )
-                api_call_specification = self.build_call_specs(self.detail_behavior)
-                auth_headers, auth_params, ssl_adapter = self.attach_saas_authorization(api_call_specification)
-
-                api_call_specification['headers'].update(**auth_headers)
-                api_call_specification['params'].update(**auth_params)
-                api_call_specification['ssl_adapter'] = ssl_adapter
+    def _build_detail_call_specs(self, list_response_item) -> dict:
+        self.update_rendering_context(
+            list_response_item=list_response_item,
+        )
+        return self.build_call_specs(self.detail_behavior)
 
-                response = self.perform_api_request(logger=self.logger, **api_call_specification)
+    @staticmethod
+    def _build_detail_response_object(list_response_item, response: Response):
+        # We should keep the list_response_item as it contains some useful information most of the time.
+        detail_response_object = response_to_object_from_response(response)
+        if type(detail_response_object) is dict:
+            detail_response_object['list_response_item'] = list_response_item
 
-                # We should keep the list_response_item as it contains some useful information most of the time.
-                detail_response_object = response_to_object(response.text)
-                if type(detail_response_object) is dict:
-                    detail_response_object['list_response_item'] = list_response_item
+        return detail_response_object
 
-                return detail_response_object
+    def get_detail_of_item(self, list_response_item):
+        if self.detail_behavior:
+            try:
+                api_call_specification = self._build_detail_call_specs(list_response_item)
+                response = self.perform_authorized_api_request(api_call_specification)
+                return self._build_detail_response_object(list_response_item, response)
             except Exception as exc:
                 self.logger.exception('Failed to fetch the details of item')
                 raise self.ManagedConnectorDetailsGetException(error=str(exc))
         else:
             return list_response_item
 
+    def _prefetch_detail_of_item(self, connection_pool: Pool, list_response_item) -> tuple:
+        """
+        Render the details call for the given item and issue it in the connection pool without waiting for the response.
+
+        The rendering happens here, in the calling greenlet, only the HTTP call itself goes to the pool. The snapshot
+        of the rendering context is returned together with the call, so the response can be processed later exactly
+        with the same context as if the items were processed one by one
+        """
+        try:
+            api_call_specification = self._build_detail_call_specs(list_response_item)
+            authorized_call_specification, session_auth_secret = self._authorize_call_specs(api_call_specification)
+            request = connection_pool.spawn(self._perform_pooled_api_request, **authorized_call_specification)
+        except Exception as exc:
+            api_call_specification, session_auth_secret, request = None, None, exc
+
+        rendering_context = dict(self.rendering_context)
+        get_item_details = partial(
+            self._get_prefetched_detail_of_item,
+            list_response_item,
+            api_call_specification,
+            session_auth_secret,
+            request
+        )
+        return list_response_item, rendering_context, get_item_details
+
+    def _perform_pooled_api_request(self, **api_call_specification):
+        """
+        Perform the API call within the connection pool. The error is returned as the value instead of being raised,
+        otherwise gevent reports the failed greenlet to stderr along with its arguments, including the SaaS authorization
+        """
+        try:
+            return self.perform_api_request(logger=self.logger, **api_call_specification)
+        except Exception as exc:
+            return exc
+
+    def _get_prefetched_detail_of_item(self, list_response_item, api_call_specification: dict, session_auth_secret: Optional[tuple], request):
+        try:
+            if isinstance(request, Exception):
+                raise request
+
+            response = request.get()
+            if isinstance(response, HTTPError):
+                response = self._retry_if_saas_authorization_rejected(response, api_call_specification, session_auth_secret)
+            elif isinstance(response, Exception):
+                raise response
+
+            return self._build_detail_response_object(list_response_item, response)
+        except Exception as exc:
+            self.logger.exception('Failed to fetch the details of item')
+            raise self.ManagedConnectorDetailsGetException(error=str(exc))
+
+    def _prefetch_details_of_items(self, list_of_items, pool_size: int):
+        """
+        Fetch the details of the items concurrently, at most `pool_size` calls at once, keeping the original order of items
+        """
+        connection_pool = Pool(size=pool_size)
+        prefetched = deque()
+        try:
+            try:
+                for list_response_item in list_of_items:
+                    prefetched.append(self._prefetch_detail_of_item(connection_pool, list_response_item))
+                    if len(prefetched) >= pool_size:
+                        yield prefetched.popleft()
+            except Exception:
+                # NOTE: the list of items has failed somewhere in the middle, process the items fetched so far as it
+                # would happen within the sequential processing and only then raise the error
+                while prefetched:
+                    yield prefetched.popleft()
+                raise
+
+            while prefetched:
+                yield prefetched.popleft()
+        finally:
+            connection_pool.kill()
+
     def get_local_inputs(self) -> dict:
-        if isinstance(self.settings.get("local_inputs"), str):
-            inputs_from_local = json.loads(self.settings["local_inputs"])
-        elif isinstance(self.settings.get("local_inputs"), dict):
-            inputs_from_local = self.settings["local_inputs"]
-        else:
+        inputs_from_local = self.settings.get("local_inputs")
+        if not isinstance(inputs_from_local, dict):
             raise ConfigError(f'Managed connector #{self.ConnectorID}: local inputs have invalid format. Exiting')
         return inputs_from_local
 
     def _load_list(self, iam_credentials: dict = None, skip_empty_response: bool = False):
         # NOTE: There are no Details and Software Behaviours for AWS Connectors
         # So special IAM adjustments are not required
-        for list_response_item in self.get_list_of_items(iam_credentials=iam_credentials, skip_empty_response=skip_empty_response):
-            try:
-                item_details = self.get_detail_of_item(list_response_item)
-                self._add_desktop_software(item_details)
-                self._add_saas_information(item_details)
-            except (
-                self.ManagedConnectorSoftwareGetException,
-                self.ManagedConnectorDetailsGetException,
-                self.ManagedConnectorSaaSGetException
-            ) as e:
-                yield list_response_item, str(e)
-            else:
-                yield item_details
+        list_of_items = self.get_list_of_items(iam_credentials=iam_credentials, skip_empty_response=skip_empty_response)
+
+        # NOTE: the details are fetched with the separate call per item, so these calls can be issued concurrently.
+        # The number of them is set separately from the workers pushing the records to Oomnitza, it is limited by the SaaS API
+        pool_size = self.settings['detail_workers']
+        if self.detail_behavior and pool_size > 1:
+            list_of_items = self._prefetch_details_of_items(list_of_items, pool_size)
+        else:
+            list_of_items = (
+                (list_response_item, None, partial(self.get_detail_of_item, list_response_item))
+                for list_response_item in list_of_items
+            )
+
+        for list_response_item, rendering_context, get_item_details in list_of_items:
+            with self.isolated_rendering_context(rendering_context):
+                try:
+                    item_details = get_item_details()
+                    self._add_desktop_software(item_details)
+                    self._add_saas_information(item_details)
+                except (
+                    self.ManagedConnectorSoftwareGetException,
+                    self.ManagedConnectorDetailsGetException,
+                    self.ManagedConnectorSaaSGetException
+                ) as e:
+                    record = list_response_item, str(e)
+                else:
+                    record = item_details
+
+            yield record
 
     def _load_iam_list(self):
         iteration = 0
@@ -488,14 +697,8 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
     def _call_endpoint_for_software(self):
         api_call_specification = self.build_call_specs(self.software_behavior)
-        auth_headers, auth_params, ssl_adapter = self.attach_saas_authorization(api_call_specification)
-
-        api_call_specification['headers'].update(**auth_headers)
-        api_call_specification['params'].update(**auth_params)
-        api_call_specification['ssl_adapter'] = ssl_adapter
-
-        response = self.perform_api_request(logger=self.logger, **api_call_specification)
-        return response_to_object(response.text)
+        response = self.perform_authorized_api_request(api_call_specification)
+        return response_to_object_from_response(response)
 
     def _build_list_of_software(self, software_response):
         self.update_rendering_context(
@@ -504,13 +707,20 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
         list_of_software = []
 
-        for item in self.render_to_native(self.software_behavior['result']):
-            self.update_rendering_context(
-                software_response_item=item
-            )
+        # NOTE: the templates and the renderer methods are the same for every software item, so look them up only once
+        name_template = self.software_behavior['name']
+        version_template = self.software_behavior['version']
+        rendering_context = self.rendering_context
+        render_to_native = self.render_to_native
+        render_to_string = self.render_to_string
+
+        for item in render_to_native(self.software_behavior['result']):
+            rendering_context['software_response_item'] = item
+            # the version is passed as the string, but only if it is defined at all
+            version = render_to_native(version_template)
             list_of_software.append({
-                'name': self.render_to_native(self.software_behavior['name']),
-                'version': self.render_to_string(self.software_behavior['version']) if self.render_to_native(self.software_behavior['version']) is not None else None,
+                'name': render_to_native(name_template),
+                'version': render_to_string(version_template) if version is not None else None,
                 'path': None
             })
 
@@ -520,20 +730,32 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         if software_list:
             item_details['software'] = software_list
 
+    def _build_saas_payload(self) -> Optional[dict]:
+        """
+        The SaaS information attached to the items depends only on the saas_behavior, so build it once
+        """
+        if not (isinstance(self.saas_behavior, dict) and self.saas_behavior.get('enabled') and self.saas_behavior.get('sync_key')):
+            return None
+
+        saas_payload = {
+            'sync_key': self.saas_behavior['sync_key']
+        }
+
+        selected_saas_id = self.saas_behavior.get('selected_saas_id')
+        if selected_saas_id:
+            saas_payload['selected_saas_id'] = selected_saas_id
+
+        saas_name = self.saas_behavior.get('name')
+        if saas_name:
+            saas_payload['name'] = saas_name
+
+        return saas_payload
+
     def _add_saas_information(self, item_details):
         try:
-            if isinstance(self.saas_behavior, dict) and self.saas_behavior.get('enabled') and self.saas_behavior.get('sync_key'):
-                item_details['saas'] = {
-                    'sync_key': self.saas_behavior['sync_key']
-                }
-
-                selected_saas_id = self.saas_behavior.get('selected_saas_id')
-                if selected_saas_id:
-                    item_details['saas']['selected_saas_id'] = selected_saas_id
-
-                saas_name = self.saas_behavior.get('name')
-                if saas_name:
-                    item_details['saas']['name'] = saas_name
+            if self._saas_payload is not None:
+                # NOTE: every item gets its own copy, so the items do not share the same mutable object
+                item_details['saas'] = dict(self._saas_payload)
 
         except Exception as exc:
             self.logger.exception('Failed to fetch the saas info')
@@ -25,16 +25,20 @@ class Connector(UserConnector):
     def __init__(self, section, settings):
         super(Connector, self).__init__(section, settings)
         self.url_template = "https://%s.zendesk.com/api/{0}" % self.settings['system_name']
-
-    def get_headers(self):
-        return {
+        self._users_url = self.url_template.format("v2/users.json")
+        self._organizations_url = self.url_template.format("v2/organizations.json")
+        self._load_organizations = bool(self.settings.get('load_organizations'))
+        self._headers = {
             'Accept': 'application/json',
             'Authorization':  _basic_auth_str(f"{self.settings['username']}/token", self.settings['api_token'])
         }
 
+    def get_headers(self):
+        return self._headers
+
     def _load_records(self, options):
         organization_map = self._load_organizations_if_needed()
-        url = self.url_template.format("v2/users.json")
+        url = self._users_url
         while url:
             response = self.get(url)
             response = response.json()
@@ -43,34 +47,31 @@ class Connector(UserConnector):
                 # We've likely gotten all the users we're going to get
                 url = None
             else:
-                for user in response['users']:
-                    if organization_map:
-                        org = organization_map.get(user['organization_id'], None)
-                        if org:
-                            user['organization'] = org
-                        else:
-                            user['organization'] = {}
-                    yield user
+                if organization_map:
+                    get_organization = organization_map.get
+                    for user in response['users']:
+                        user['organization'] = get_organization(user['organization_id']) or {}
+                        yield user
+                else:
+                    yield from response['users']
                 url = response['next_page']
 
     def _load_organizations_if_needed(self):
-        """Loads and returns the Zendesk organizations if 'organization_id' is a source field.
-
-        Checks the field_mappings to see if 'organization_id' is a source field.
+        """Loads and returns the Zendesk organizations if the 'load_organizations' setting is enabled.
 
         Returns
         -------
             dict
-                A dict mapping organization_id -> organization_name, or None if 'organization_id' is not a source field.
+                A dict mapping organization_id -> organization, or None if the organizations are not needed.
 
         """
-        if not self.settings.get('load_organizations'):
+        if not self._load_organizations:
             return None
 
         self.logger.info("Loading Zendesk Organizations...")
 
         organization_map = {}
-        url = self.url_template.format("v2/organizations.json")
+        url = self._organizations_url
         while url:
             response = self.get(url)
             response = response.json()
@@ -79,8 +80,7 @@ class Connector(UserConnector):
                 # We've likely gotten all the organizations we're going to get
                 url = None
             else:
-                for organization in response['organizations']:
-                    organization_map[organization["id"]] = organization
+                organization_map.update((organization["id"], organization) for organization in response['organizations'])
                 url = response['next_page']
 
         self.logger.info("Loaded %s organizations.", len(organization_map))
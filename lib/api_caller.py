@@ -1,5 +1,6 @@
 import logging
 from typing import Optional
+from urllib.parse import urlsplit
 
 from lib.httpadapters import SSLAdapter
 from lib.renderer import Renderer
@@ -28,7 +29,11 @@ class ExternalAPICaller:
         # noinspection PyUnresolvedReferences
         session = self._get_session()
         if ssl_adapter:
-            session.mount(url, ssl_adapter)
+            # NOTE: mount the adapter for the whole host instead of the exact URL, so the connections are reused by the
+            # further calls to the same API and the session does not collect the mounted adapters for every single URL
+            host_prefix = '{0.scheme}://{0.netloc}/'.format(urlsplit(url))
+            if session.adapters.get(host_prefix) is not ssl_adapter:
+                session.mount(host_prefix, ssl_adapter)
 
         logger.info('Issuing %s %s', http_method, url)
         logger.debug('..params=[%s]', params)
@@ -55,23 +60,48 @@ class ExternalAPICaller:
 
 class ConfigurableExternalAPICaller(ExternalAPICaller, Renderer):
 
+    prepared_call_specs = None
+
+    def _prepare_call_specs(self, http_specs: dict) -> tuple:
+        """
+        Extract the structure of the given call specification which does not depend on the rendering context,
+        this is done only once per specification, so the only thing left for every call is the rendering of the values
+        """
+        if self.prepared_call_specs is None:
+            self.prepared_call_specs = {}
+
+        # NOTE: the specification itself is kept along with the prepared one, so its id cannot be reused by another object
+        cached_specs, prepared = self.prepared_call_specs.get(id(http_specs), (None, None))
+        if cached_specs is not http_specs:
+            prepared = (
+                http_specs['http_method'],
+                http_specs['url'],
+                'body' in http_specs,
+                http_specs.get('body'),
+                tuple((_['key'], _['value']) for _ in http_specs['headers']),
+                tuple((_['key'], _['value']) for _ in http_specs['params']),
+            )
+            self.prepared_call_specs[id(http_specs)] = (http_specs, prepared)
+
+        return prepared
+
     def build_call_specs(
         self, 
         http_specs: dict, 
         raise_error: bool = True
     ) -> dict:
+        http_method, url, has_body, body, headers, params = self._prepare_call_specs(http_specs)
 
         call_spec = dict(
             raise_error=raise_error,
-            http_method=http_specs['http_method'],
-            url=self.render_to_string(http_specs['url']),
+            http_method=http_method,
+            url=self.render_to_string(url),
         )
-        if 'body' in http_specs:
-            call_spec['body'] = self.render_to_string(http_specs['body'])
+        if has_body:
+            call_spec['body'] = self.render_to_string(body)
         else:
             call_spec['body'] = None
 
-        call_spec['headers'] = {_['key']: self.render_to_string(_['value']) for _ in http_specs['headers']}
-        call_spec['params'] = {_['key']: self.render_to_string(_['value']) for _ in http_specs['params']}
+        call_spec['headers'] = {key: self.render_to_string(value) for key, value in headers}
+        call_spec['params'] = {key: self.render_to_string(value) for key, value in params}
         return call_spec
-
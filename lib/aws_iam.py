@@ -2,7 +2,7 @@ import json
 import uuid
 from typing import List, Iterator
 from urllib.parse import unquote
-from lib.connector import response_to_object
+from lib.connector import response_to_object_from_response
 
 
 class AWSIAM:
@@ -34,7 +34,7 @@ class AWSIAM:
             logger=self._managed_connector.logger, 
             **api_call_specification
         )
-        response_object = response_to_object(response.text)
+        response_object = response_to_object_from_response(response)
 
         return response_object
 
@@ -1,6 +1,8 @@
+import codecs
 import copy
 import errno
 import json
+import orjson
 import xmltodict
 import logging
 import os
@@ -32,14 +34,38 @@ SAVED_DATA_PATH = "./save_data"
 def response_to_object(response_text):
     """
     Try to represent the response as the native object from the JSON- or XML-based response
+
+    The response can be given either as the text or as the raw bytes, the bytes are preferable because the JSON parser
+    can work with them directly skipping the decoding. The stdlib json is kept as the fallback for the values `orjson`
+    does not accept, such as NaN or the integers bigger than 64-bit
     """
-    try:
-        return json.loads(response_text)
-    except:
+    for parser in (orjson.loads, json.loads, xmltodict.parse):
         try:
-            return xmltodict.parse(response_text)
+            return parser(response_text)
         except:
-            return response_text
+            continue
+
+    return response_text
+
+
+def response_to_object_from_response(response: requests.Response):
+    """
+    Represent the body of the given response as the native object, see `response_to_object`
+
+    The raw bytes are parsed directly only if the response is in UTF-8 or does not declare the charset at all,
+    otherwise the text decoded with the declared charset is parsed. If the raw bytes cannot be parsed (e.g. the body is in
+    some other charset not declared by the response), the text decoded with the guessed charset is parsed instead
+    """
+    try:
+        parse_raw_bytes = not response.encoding or codecs.lookup(response.encoding).name == 'utf-8'
+    except LookupError:
+        parse_raw_bytes = False
+
+    response_object = response_to_object(response.content if parse_raw_bytes else response.text)
+    if isinstance(response_object, bytes):
+        return response_to_object(response.text)
+
+    return response_object
 
 
 def run_connector(connector_cfg, options):
@@ -892,7 +918,7 @@ class BaseConnector(object):
             # fallback / simplification compatibility, treat the incoming value as the jinja2 variable
             field_template = self.jinja_native_env.variable_start_string + field + self.jinja_native_env.variable_end_string
 
-        value = self.jinja_native_env.from_string(field_template).render(
+        value = self.get_compiled_native_template(field_template).render(
             **sanitize_jinja_call_args(data)
         )
 
@@ -1,8 +1,9 @@
 import importlib
+from contextlib import contextmanager
 from logging import Logger
 from typing import Any, Optional, Dict
 
-from jinja2 import UndefinedError, Undefined, TemplateSyntaxError, Environment, environmentfilter
+from jinja2 import UndefinedError, Undefined, TemplateSyntaxError, Environment, Template, environmentfilter
 from jinja2.exceptions import SecurityError
 from jinja2.nativetypes import NativeEnvironment
 from jinja2.sandbox import SandboxedEnvironment
@@ -107,6 +108,15 @@ class StringEnvironmentWithImportSupport(ImportSupportJinjaEnvMixin, Environment
     pass
 
 
+# NOTE: the environments do not keep any state specific to the connector, the rendering context is passed
+# explicitly on every render, so build them once per process instead of once per connector instance
+_jinja_string_env = StringEnvironmentWithImportSupport()
+_jinja_native_env = SafeNativeEnvironmentWithImportSupport()
+_jinja_native_env.filters.update({
+    "as_is": as_is,
+})
+
+
 class _GlobalVariableContext:
     """
     Implementation of the global settings for the Jinja context
@@ -142,6 +152,8 @@ class Renderer:
     jinja_string_env = None
     jinja_native_env = None
     rendering_context = None
+    compiled_string_templates = None
+    compiled_native_templates = None
 
     def __init__(self, *args, **kwargs):
         # NOTE 1: Init 3d-party context at the class initialization to avoid extra
@@ -158,11 +170,13 @@ class Renderer:
             'GlobalSetting': _GlobalVariableContext(oomnitza_connector=oomnitza_connector)
         }
 
-        self.jinja_string_env = StringEnvironmentWithImportSupport()
-        self.jinja_native_env = SafeNativeEnvironmentWithImportSupport()
-        self.jinja_native_env.filters.update({
-            "as_is": as_is,
-        })
+        self.jinja_string_env = _jinja_string_env
+        self.jinja_native_env = _jinja_native_env
+
+        # NOTE: the managed connector renders the same set of templates (pagination controls, result expressions, etc.)
+        # for every page and every item, so keep the compiled templates and skip the parsing & compilation next time
+        self.compiled_string_templates = {}
+        self.compiled_native_templates = {}
         super().__init__(*args, **kwargs)
 
     def update_rendering_context(self, **kwargs):
@@ -172,12 +186,49 @@ class Renderer:
         for arg in args:
             self.rendering_context.pop(arg, None)
 
+    @contextmanager
+    def isolated_rendering_context(self, rendering_context: Optional[Dict]):
+        """
+        Temporarily render with the copy of the given context instead of the current one, the current context is
+        restored at the exit untouched. If no context given, the current one is used as is
+        """
+        if rendering_context is None:
+            yield
+            return
+
+        current_rendering_context = self.rendering_context
+        self.rendering_context = dict(rendering_context)
+        try:
+            yield
+        finally:
+            self.rendering_context = current_rendering_context
+
+    @staticmethod
+    def _get_compiled_template(env: Environment, compiled_templates: dict, template: Any) -> Template:
+        source = str(template)
+        compiled_template = compiled_templates.get(source)
+        if compiled_template is None:
+            compiled_template = compiled_templates[source] = env.from_string(source)
+        return compiled_template
+
+    def get_compiled_string_template(self, template: Any) -> Template:
+        """
+        Return the compiled template for the rendering to the string, compile it only once
+        """
+        return self._get_compiled_template(self.jinja_string_env, self.compiled_string_templates, template)
+
+    def get_compiled_native_template(self, template: Any) -> Template:
+        """
+        Return the compiled template for the rendering to the native value, compile it only once
+        """
+        return self._get_compiled_template(self.jinja_native_env, self.compiled_native_templates, template)
+
     def render_to_string(self, template: Any) -> str:
         """
         Render the value to the string
         """
         try:
-            return self.jinja_string_env.from_string(str(template)).render(**self.rendering_context)
+            return self.get_compiled_string_template(template).render(**self.rendering_context)
         except UndefinedError:
             logger.debug(f'Failed to render to string. Template: {str(template)}. Context: {self.rendering_context}')
             return ''
@@ -189,7 +240,7 @@ class Renderer:
         Render the value to its native type based on the inputs
         """
         try:
-            val = self.jinja_native_env.from_string(str(template)).render(**self.rendering_context)
+            val = self.get_compiled_native_template(template).render(**self.rendering_context)
             if val == Undefined():
                 raise UndefinedError
 